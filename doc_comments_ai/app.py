@@ -1,10 +1,12 @@
 import argparse
+import asyncio
 import os
 import sys
 
 from yaspin import yaspin
 
 from doc_comments_ai import llm, utils
+from doc_comments_ai.cache import ResponseCache
 from doc_comments_ai.llm import GptModel
 from doc_comments_ai.treesitter import Treesitter, TreesitterMethodNode
 
@@ -28,6 +30,21 @@ def run():
         type=str,
         help="Path to the local model.",
     )
+    parser.add_argument(
+        "--n_gpu_layers",
+        type=int,
+        help="Number of model layers offloaded to the GPU when using a local model (-1 offloads all layers).",
+    )
+    parser.add_argument(
+        "--n_batch",
+        type=int,
+        help="Number of prompt tokens processed in parallel when using a local model.",
+    )
+    parser.add_argument(
+        "--n_threads",
+        type=int,
+        help="Number of CPU threads used when using a local model.",
+    )
     parser.add_argument(
         "--comment_with_source_code",
         action="store_true",
@@ -70,6 +87,35 @@ def run():
         help="Ollama base url",
     )
 
+    parser.add_argument(
+        "--quant",
+        type=str,
+        help="Quantization appended to the tag of the Ollama model, e.g. q4_K_M turns llama3:8b-instruct into llama3:8b-instruct-q4_K_M.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        default=8,
+        type=int,
+        help="Maximum number of methods documented with a single request if only comments are generated (default: 8, 1 disables batching).",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Request a single doc comment for methods which only differ in their identifiers and rename the identifiers for the others. Only applies if only comments are generated.",
+    )
+    parser.add_argument(
+        "--max_output_tokens",
+        default=512,
+        type=int,
+        help="Maximum number of tokens generated for a doc comment, on top of the method itself if the source code is returned (default: 512).",
+    )
+
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Always query the LLM instead of reusing responses cached in ~/.cache/doc-comments-ai.",
+    )
+
     parser.add_argument(
         "--regenerate_docstring",
         default=False,
@@ -94,20 +140,117 @@ def run():
     if utils.has_unstaged_changes(file_name):
         sys.exit(f"File {utils.get_bold_text(file_name)} has unstaged changes")
 
+    llm_wrapper = create_llm(args)
+
+    process_file(
+        file_name,
+        llm_wrapper,
+        line_threshold=args.line_threshold,
+        inline=args.inline,
+        comment_with_source_code=args.comment_with_source_code,
+        guided=args.guided,
+        regenerate_docstring=args.regenerate_docstring,
+        token_limit=None if (args.gpt4 or args.gpt3_5_16k or args.ollama_model) else 2048,
+        batch_size=args.batch_size,
+        dedupe=args.dedupe,
+    )
+
+
+def create_llm(args) -> llm.LLM:
+    """
+    Instantiates the LLM wrapper selected by the parsed command line arguments.
+    """
+    kwargs = {
+        "cache": None if args.no_cache else ResponseCache(),
+        "max_output_tokens": args.max_output_tokens,
+    }
     if args.azure_deployment:
         utils.is_azure_openai_environment_available()
-        llm_wrapper = llm.LLM(azure_deployment=args.azure_deployment)
+        return llm.LLM(azure_deployment=args.azure_deployment, **kwargs)
     elif args.gpt4:
         utils.is_openai_api_key_available()
-        llm_wrapper = llm.LLM(model=GptModel.GPT_4)
+        return llm.LLM(model=GptModel.GPT_4, **kwargs)
     elif args.gpt3_5_16k:
         utils.is_openai_api_key_available()
-        llm_wrapper = llm.LLM(model=GptModel.GPT_35_16K)
+        return llm.LLM(model=GptModel.GPT_35_16K, **kwargs)
     elif args.ollama_model:
-        llm_wrapper = llm.LLM(ollama=(args.ollama_base_url, args.ollama_model))
+        ollama_model = args.ollama_model
+        if args.quant:
+            ollama_model = utils.apply_quantization_tag(ollama_model, args.quant)
+        return llm.LLM(ollama=(args.ollama_base_url, ollama_model), **kwargs)
     else:
-        llm_wrapper = llm.LLM(local_model=args.local_model)
+        return llm.LLM(
+            local_model=args.local_model,
+            n_gpu_layers=args.n_gpu_layers,
+            n_batch=args.n_batch,
+            n_threads=args.n_threads,
+            **kwargs,
+        )
+
+
+def process_file(file_name: str, llm_wrapper: llm.LLM, **kwargs):
+    """
+    Generates doc comments for all methods in the given file with an already
+    instantiated LLM wrapper, so that it can be reused across several files.
+
+    See aprocess_file for the supported keyword arguments.
+    """
+    asyncio.run(aprocess_file(file_name, llm_wrapper, **kwargs))
+
+
+async def aprocess_file(
+    file_name: str,
+    llm_wrapper: llm.LLM,
+    line_threshold: int = 3,
+    inline: bool = False,
+    comment_with_source_code: bool = False,
+    guided: bool = False,
+    regenerate_docstring: bool = False,
+    token_limit: "int | None" = 2048,
+    batch_size: int = 8,
+    dedupe: bool = False,
+):
+    """
+    Generates doc comments for all methods in the given file.
+
+    The prompts of all methods in the file are sent to the LLM concurrently,
+    the results are written back to the file once all of them are available.
+    """
+    programming_language, methods, total_original_tokens = collect_methods(
+        file_name, line_threshold, guided, regenerate_docstring, token_limit
+    )
+
+    doc_comment_results = []
+    if methods:
+        spinner = yaspin(text=f"🔧 Generating doc comments for {len(methods)} methods...")
+        spinner.start()
+
+        doc_comment_results = await generate_doc_comments(
+            llm_wrapper, programming_language, methods, inline, comment_with_source_code, batch_size, dedupe
+        )
 
+        spinner.stop()
+
+    total_generated_tokens = write_doc_comments(
+        file_name, programming_language, methods, doc_comment_results, inline, comment_with_source_code
+    )
+
+    print(f"📊 Total Input Tokens: {total_original_tokens}")
+    print(f"🚀 Total Generated Tokens: {total_generated_tokens}")
+
+
+def collect_methods(
+    file_name: str,
+    line_threshold: int = 3,
+    guided: bool = False,
+    regenerate_docstring: bool = False,
+    token_limit: "int | None" = 2048,
+):
+    """
+    Parses the given file and returns its programming language, the
+    (name, source code, doc comment) tuples of the methods which need a doc
+    comment and the number of tokens of these methods.
+    """
     with open(file_name, "r") as file:
         # Read the entire content of the file into a string
         file_bytes = file.read().encode()
@@ -120,9 +263,8 @@ def run():
             file_bytes
         )
 
-    regenerate_docstring = args.regenerate_docstring
     total_original_tokens = 0
-    total_generated_tokens = 0
+    methods = []
 
     for node in treesitterNodes:
         method_name = utils.get_bold_text(node.name)
@@ -133,7 +275,15 @@ def run():
             )
             continue
 
-        if args.guided:
+        # Filter out trivial methods before any further work is spent on them
+        code_lines = [line for line in node.method_source_code.splitlines() if line.strip()]
+        if len(code_lines) <= line_threshold:
+            print(
+                f"❌ Method {method_name} does not satisfy the line_threshold. Skipping..."
+            )
+            continue
+
+        if guided:
             print(f"Generate doc for {utils.get_bold_text(method_name)}? (y/n)")
             if not input().lower() == "y":
                 continue
@@ -144,7 +294,7 @@ def run():
 
         tokens = utils.count_tokens(method_comment+method_source_code) if method_comment is not None else utils.count_tokens(method_source_code)
         total_original_tokens += tokens
-        if tokens > 2048 and not (args.gpt4 or args.gpt3_5_16k or args.ollama_model):
+        if token_limit is not None and tokens > token_limit:
             print(
                 f"❌ Method {method_name} has too many tokens. "
                 f"Consider using {utils.get_bold_text('--gpt4')} "
@@ -153,29 +303,65 @@ def run():
             )
             continue
 
-        if method_source_code.count('\n') <= args.line_threshold:
-            print(
-                f"❌ Method {method_name} does not satisfy the line_threshold. Skipping..."
-            )
-            continue
+        methods.append((method_name, method_source_code, method_comment))
 
-        spinner = yaspin(text=f"🔧 Generating doc comment for {method_name}...")
-        spinner.start()
+    return programming_language, methods, total_original_tokens
 
-        #print("Source code:", method_source_code)
-        #print("Source comment:", method_comment)
-        doc_comment_result = llm_wrapper.generate_doc_comment(
-                programming_language.value, method_source_code, args.inline, args.comment_with_source_code, method_comment
-            )
-        #print("Result: ", doc_comment_result)
+
+async def generate_doc_comments(
+    llm_wrapper: llm.LLM,
+    programming_language,
+    methods,
+    inline: bool = False,
+    comment_with_source_code: bool = False,
+    batch_size: int = 8,
+    dedupe: bool = False,
+):
+    """
+    Requests the doc comments for the methods returned by collect_methods.
+    """
+    if inline or comment_with_source_code:
+        return await asyncio.gather(
+            *[
+                llm_wrapper.agenerate_doc_comment(
+                    programming_language.value, method_source_code, inline, comment_with_source_code, method_comment
+                )
+                for _, method_source_code, method_comment in methods
+            ]
+        )
+
+    # Only the comments are requested, so several methods fit in one request
+    return await llm_wrapper.agenerate_doc_comments(
+        programming_language.value,
+        [method_source_code for _, method_source_code, _ in methods],
+        batch_size,
+        dedupe,
+    )
+
+
+def write_doc_comments(
+    file_name: str,
+    programming_language,
+    methods,
+    doc_comment_results,
+    inline: bool = False,
+    comment_with_source_code: bool = False,
+) -> int:
+    """
+    Writes the generated doc comments back to the file and returns the
+    number of generated tokens.
+    """
+    total_generated_tokens = 0
+    for (method_name, method_source_code, method_comment), doc_comment_result in zip(
+        methods, doc_comment_results
+    ):
         generated_tokens = utils.count_tokens(doc_comment_result)
         total_generated_tokens += generated_tokens
 
-        if args.inline or args.comment_with_source_code:
+        if inline or comment_with_source_code:
             parsed_doc_comment = utils.extract_content_from_markdown_code_block(
                 doc_comment_result
             )
-            #print("\n\nParsed markdown:", parsed_doc_comment)
             utils.write_code_snippet_to_file(
                 file_name, method_source_code, parsed_doc_comment, method_comment
             )
@@ -183,14 +369,10 @@ def run():
             parsed_doc_comment = utils.extract_comments_from_markdown_code_block(
                 programming_language.value, doc_comment_result
             )
-            #print(parsed_doc_comment)
             utils.write_only_comments_to_file(
                 file_name, method_source_code, parsed_doc_comment
             )
 
-        spinner.stop()
-
         print(f"✅ Doc comment for {method_name} generated.")
-    
-    print(f"📊 Total Input Tokens: {total_original_tokens}")
-    print(f"🚀 Total Generated Tokens: {total_generated_tokens}")
+
+    return total_generated_tokens
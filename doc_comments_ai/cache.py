@@ -0,0 +1,55 @@
+import hashlib
+import os
+import sqlite3
+
+
+def get_default_cache_path() -> str:
+    """
+    Returns the path of the response cache database, which is located in
+    $XDG_CACHE_HOME/doc-comments-ai (default ~/.cache/doc-comments-ai).
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "doc-comments-ai", "responses.sqlite")
+
+
+class ResponseCache:
+    """
+    Persistent key-value store for LLM responses, keyed by a hash of everything
+    that influences the response. Identical methods are therefore only sent to
+    the LLM once, also across separate runs.
+    """
+
+    def __init__(self, path: "str | None" = None):
+        self.path = path or get_default_cache_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """
+        Returns the sha256 hex digest of the given parts. The parts are separated
+        by a NUL byte so that shifting text between two parts changes the key.
+        """
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> "str | None":
+        row = self.connection.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, response: str) -> None:
+        # An empty response is a failed one, it is requested again next time
+        if not response or not response.strip():
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+            (key, response),
+        )
+        self.connection.commit()
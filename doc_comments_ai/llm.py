@@ -1,16 +1,134 @@
+import asyncio
+import functools
+import importlib.util
 import os
+import platform
+import shutil
 import subprocess
 import sys
 from enum import Enum
 
 import inquirer
-from langchain_community.chat_models import ChatLiteLLM
-from langchain_community.llms import LlamaCpp
-
-from langchain_ollama import OllamaLLM
-from langchain_core.prompts import ChatPromptTemplate
 
 from doc_comments_ai import utils
+from doc_comments_ai.cache import ResponseCache
+from doc_comments_ai.llm_clients import LiteLLMClient, LlamaCppClient, OllamaClient
+
+
+# The instructions only depend on the comment mode, so they are built once
+COMMENT_INSTRUCTIONS = {
+    "inline": (
+        "Add inline comments to the method body where it makes sense."
+        "Return the complete method implementation with the doc comment as a single markdown code block. "
+        "IMPORTANT: Ensure that absolutely no part of the original function is omitted or modified in your response. Every line, including imports, comments, and variable bindings, should be retained in the output. This is crucial to satisfy my use case."
+    ),
+    "comment_with_source_code": (
+        "Return the complete method implementation with the doc comment as a single markdown code block. "
+        "If a docstring already exists in the code, please reuse its content as much as possible and revise the docstring to reflect any detail that is missing in the existing docstring. "
+        "IMPORTANT: Ensure that absolutely no part of the original function's implementation is omitted or modified in your response. Every line, including imports, comments, and variable bindings, should be retained in the output. This is crucial to satisfy my use case. "
+        "The docstring may, however, be revised. "
+        "IMPORTANT: It is vital that everything is wrapped inside a single markdown code block only."
+    ),
+    "comment": (
+        "Return the doc comment as a single markdown block. "
+        "If the doc comment consists of more than one sentence then please follow multi-line comments."
+        "IMPORTANT: Please avoid writing any code in the markdown block. Ensure that the markdown block contains only doc comments and enclose them appropriately using the correct comment delimiters for the language of the method."
+        """
+                Example Comment for Haskell language:
+                -- | This is the first line of a demo comment.
+                -- This is the second line of a demo comment."
+                i.e. Correct comment delimiters for Haskell language is '-- ' where the first line of the comment will be prefixed with '-- | '.
+                """
+        "Strictly avoid writing detailed comments for self-explanatory functions."
+        "IMPORTANT: Strictly refrain from detailing input parameters or specifying what the function takes as input and its definition. This is crucial to meet my use case."
+        "IMPORTANT: Please follow only the specified format. This is very important to satisfy my use case."
+    ),
+}
+
+# Instructions to document several methods in a single request
+BATCH_COMMENT_INSTRUCTIONS = (
+    "Several methods are provided, each one preceded by a line of the form '### FUNCTION <number> ###'. "
+    "Write a doc comment for every method. "
+    "Return only a JSON array of strings, where the n-th string is the doc comment of method n. "
+    "Every doc comment must be enclosed with the correct comment delimiters for the language of the methods "
+    "(e.g. '-- | ' for the first and '-- ' for the following lines in Haskell) and must not contain any code. "
+    "If a doc comment consists of more than one sentence then please follow multi-line comments. "
+    "Strictly avoid writing detailed comments for self-explanatory functions. "
+    "IMPORTANT: Strictly refrain from detailing input parameters or specifying what the function takes as input and its definition. This is crucial to meet my use case. "
+    "IMPORTANT: Respond with the JSON array only. This is very important to satisfy my use case."
+)
+
+HASKELL_INSTRUCTIONS = "Don't include missing type signatures in your response. "
+
+DOCSTRING_INSTRUCTIONS = (
+    "Additionally, the following docstring is also provided, please reuse its content "
+    "to revise any detail that is missing in the existing docstring "
+)
+
+
+# The system prompt contains no variables, so every request starts with the
+# same prefix and can be served from a prompt cache. Everything that depends
+# on the method goes to the end of the prompt.
+SYSTEM_PROMPT = (
+    "Act as a software documentation expert. "
+    "Add detailed doc comments to the provided method without changing any code. "
+    "The doc comments should describe what the method does. "
+    "Don't include any explanations in your response."
+)
+
+USER_PROMPT = "The method is written in {language} language. {method_instructions}\n\n{code}"
+
+BATCH_USER_PROMPT = "The methods are written in {language} language. {method_instructions}\n\n{code}"
+
+# Quantizations of Ollama models with a good tradeoff between speed and quality
+RECOMMENDED_OLLAMA_QUANTIZATIONS = {"Q4_K_M", "Q5_K_M", "Q4_0"}
+
+
+@functools.lru_cache(maxsize=None)
+def has_command(command):
+    # A lookup on the PATH, no process is spawned
+    return shutil.which(command) is not None
+
+
+@functools.lru_cache(maxsize=None)
+def supports_metal():
+    # Check for macOS version
+    if platform.system() == "Darwin":
+        mac_version = tuple(map(int, platform.mac_ver()[0].split(".")))
+        # Metal requires macOS 10.11 or later
+        if mac_version >= (10, 11):
+            return True
+    return False
+
+
+def install_llama(backend):
+    env_vars = {"FORCE_CMAKE": "1"}
+
+    if backend == "cuBLAS":
+        env_vars["CMAKE_ARGS"] = "-DLLAMA_CUBLAS=on"
+    elif backend == "hipBLAS":
+        env_vars["CMAKE_ARGS"] = "-DLLAMA_HIPBLAS=on"
+    elif backend == "Metal":
+        env_vars["CMAKE_ARGS"] = "-DLLAMA_METAL=on"
+    else:  # Default to OpenBLAS
+        env_vars[
+            "CMAKE_ARGS"
+        ] = "-DLLAMA_BLAS=ON -DLLAMA_BLAS_VENDOR=OpenBLAS"
+
+    try:
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "llama-cpp-python",
+            ],
+            env={**os.environ, **env_vars},
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"Error during installation with {backend}: {e}")
 
 
 class GptModel(Enum):
@@ -26,116 +144,325 @@ class LLM:
         local_model: "str | None" = None,
         azure_deployment: "str | None" = None,
         ollama: "tuple[str,str] | None" = None,
+        n_gpu_layers: "int | None" = None,
+        n_batch: "int | None" = None,
+        n_threads: "int | None" = None,
+        cache: "ResponseCache | None" = None,
+        max_output_tokens: int = 512,
     ):
-        max_tokens = 2048 if model == GptModel.GPT_35 else 4096
+        self.cache = cache
+        self.max_output_tokens = max_output_tokens
+        # Doc comments by the normalized form of the documented methods,
+        # to reuse them for methods which only differ in their identifiers
+        self.structure_doc_comments = {}
+        # Size of the context window; the length of the response is limited
+        # separately by max_output_tokens
+        context_tokens = 2048 if model == GptModel.GPT_35 else 4096
         if local_model is not None:
-            self.install_llama_cpp()
+            # Looking up the package spec does not import it, which is
+            # considerably cheaper than the import attempt in install_llama_cpp
+            if importlib.util.find_spec("llama_cpp") is None:
+                self.install_llama_cpp()
+            self.check_model_quantization(local_model)
+            self.model_name = local_model
 
-            self.llm = LlamaCpp(
+            # Only pass the hardware settings which were set explicitly,
+            # so that llama.cpp keeps its own defaults otherwise
+            hardware_kwargs = {
+                key: value
+                for key, value in {
+                    "n_gpu_layers": n_gpu_layers,
+                    "n_batch": n_batch,
+                    "n_threads": n_threads,
+                }.items()
+                if value is not None
+            }
+            self.llm = LlamaCppClient(
                 model_path=local_model,
                 temperature=0.8,
-                max_tokens=max_tokens,
+                n_ctx=context_tokens,
+                max_tokens=max_output_tokens,
                 verbose=False,
+                **hardware_kwargs,
             )
         elif azure_deployment is not None:
-            self.llm = ChatLiteLLM(
-                temperature=0.8,
-                max_tokens=max_tokens,
-                model=f"azure/{azure_deployment}",
-            )
+            self.model_name = f"azure/{azure_deployment}"
+            self.llm = LiteLLMClient(model=self.model_name, temperature=0.8)
         elif ollama is not None:
+            self.model_name = f"ollama/{ollama[1]}"
             if ollama[1].startswith('llama'):
-                max_tokens = 32768 #These are trained over a larger context
-            self.llm = OllamaLLM(
+                context_tokens = 32768 #These are trained over a larger context
+            self.llm = OllamaClient(
                 base_url=ollama[0],
                 model=ollama[1],
                 temperature=0.8,
-                num_ctx=max_tokens,
+                num_ctx=context_tokens,
             )
+            self.check_ollama_quantization()
         else:
-            self.llm = ChatLiteLLM(
-                temperature=0.8, max_tokens=max_tokens, model=model.value
-            )
-
-        self.template = ChatPromptTemplate.from_messages(
-            [("system", "Act as a software documentation expert in {language} language. "
-                        "Add detailed doc comments to the provided method without changing any code "
-                        "The doc comments should describe what the method does. "
-                        "{comment_instructions} "
-                        "Don't include any explanations {haskell_missing_signature}in your response."), 
-             ("user", "{code}")
-            ]
-        )
+            self.model_name = model.value
+            self.llm = LiteLLMClient(model=self.model_name, temperature=0.8)
 
-        # self.prompt = ChatPromptTemplate(
-        #     template=self.template,
-        #     input_variables=[
-        #         "language",
-        #         "code",
-        #         "comment_instructions",
-        #         "haskell_missing_signature",
-        #     ],
-        # )
-        # self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
+        self.context_tokens = context_tokens
 
     def generate_doc_comment(self, language, code, inline=False, comment_with_source_code=False, docstring=''):
         """
         Generates a doc comment for the given method
         """
-        if inline:
-            comment_instructions = (
-                "Add inline comments to the method body where it makes sense."
-                "Return the complete method implementation with the doc comment as a single markdown code block. "
-                "IMPORTANT: Ensure that absolutely no part of the original function is omitted or modified in your response. Every line, including imports, comments, and variable bindings, should be retained in the output. This is crucial to satisfy my use case."
+        messages = self._build_prompt(language, code, inline, comment_with_source_code, docstring)
+        max_tokens = self._output_token_limit(code, inline, comment_with_source_code)
+        cache_key = self._cache_key(
+            messages, max_tokens, self._comment_mode(inline, comment_with_source_code)
+        )
+        if cache_key is not None:
+            documented_code = self.cache.get(cache_key)
+            if documented_code is not None:
+                return documented_code
+
+        documented_code = self.llm.invoke(messages, max_tokens)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, documented_code)
+        return documented_code
+
+    async def agenerate_doc_comment(self, language, code, inline=False, comment_with_source_code=False, docstring=''):
+        """
+        Asynchronous variant of generate_doc_comment, so that the requests for
+        several methods can be in flight at the same time.
+        """
+        messages = self._build_prompt(language, code, inline, comment_with_source_code, docstring)
+        max_tokens = self._output_token_limit(code, inline, comment_with_source_code)
+        cache_key = self._cache_key(
+            messages, max_tokens, self._comment_mode(inline, comment_with_source_code)
+        )
+        if cache_key is not None:
+            documented_code = self.cache.get(cache_key)
+            if documented_code is not None:
+                return documented_code
+
+        if inline or comment_with_source_code:
+            documented_code = await self._astream_code_block(messages, max_tokens)
+        else:
+            documented_code = await self.llm.ainvoke(messages, max_tokens)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, documented_code)
+        return documented_code
+
+    async def _astream_code_block(self, messages, max_tokens):
+        # Everything after the markdown code block holding the method is
+        # discarded anyway, so generation is stopped as soon as it is closed
+        chunks = []
+        finder = utils.ClosingCodeFenceFinder()
+        stream = self.llm.astream(messages, max_tokens)
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                end = finder.feed(chunk)
+                if end != -1:
+                    return "".join(chunks)[:end]
+        finally:
+            await stream.aclose()
+        return "".join(chunks)
+
+    async def agenerate_doc_comments(self, language, codes, batch_size=8, dedupe=False):
+        """
+        Generates the doc comments (without source code) for several methods.
+
+        Up to batch_size methods are documented with a single request, as long as
+        they take at most half of the context window. If the response of a batch
+        cannot be parsed, its methods are requested one by one instead.
+
+        With dedupe, methods which only differ in their identifiers are requested
+        once, the doc comments of the others are derived by renaming the identifiers.
+        """
+        doc_comments = [None] * len(codes)
+        cache_keys = [
+            self._cache_key(
+                self._build_prompt(language, code, False, False, None), self.max_output_tokens, "comment"
             )
-        elif comment_with_source_code:
-            comment_instructions = (
-                "Return the complete method implementation with the doc comment as a single markdown code block. "
-                "If a docstring already exists in the code, please reuse its content as much as possible and revise the docstring to reflect any detail that is missing in the existing docstring. "
+            for code in codes
+        ]
+        normalized = [utils.normalize_identifiers(code) if dedupe else None for code in codes]
+
+        representatives = {}
+        duplicates = {}
+        batches = []
+        batch, batch_tokens = [], 0
+        for index, code in enumerate(codes):
+            if cache_keys[index] is not None:
+                doc_comments[index] = self.cache.get(cache_keys[index])
+                if doc_comments[index] is not None:
+                    continue
+
+            if dedupe:
+                normalized_code, identifiers = normalized[index]
+                structure_key = (language, normalized_code)
+                if structure_key in self.structure_doc_comments:
+                    # Documented before, e.g. in a previous file
+                    representative_identifiers, doc_comment = self.structure_doc_comments[structure_key]
+                    doc_comments[index] = utils.rename_identifiers(
+                        doc_comment, representative_identifiers, identifiers
+                    )
+                    # Renamed comments are never cached, a run without dedupe
+                    # must not pick them up
+                    if doc_comments[index] is not None:
+                        continue
+                elif structure_key in representatives:
+                    duplicates[index] = representatives[structure_key]
+                    continue
+                else:
+                    representatives[structure_key] = index
+
+            tokens = utils.count_tokens(code)
+            if batch and (
+                len(batch) >= batch_size
+                or batch_tokens + tokens > self.context_tokens // 2
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(index)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+
+        async def generate_batch(batch):
+            if len(batch) > 1:
+                batch_comments = await self._agenerate_batch(
+                    language, [codes[index] for index in batch]
+                )
+                if batch_comments is not None:
+                    for index, doc_comment in zip(batch, batch_comments):
+                        doc_comments[index] = doc_comment
+                        if cache_keys[index] is not None:
+                            self.cache.set(cache_keys[index], doc_comment)
+                    return
+
+            results = await asyncio.gather(
+                *[self.agenerate_doc_comment(language, codes[index]) for index in batch]
             )
-            if docstring and len(docstring.strip())>0:
-                comment_instructions += 'Additionally, the following docstring is also provided, please reuse its content to revise any detail that is missing in the existing docstring '
-                comment_instructions += docstring + '. '
-            
-            comment_instructions += (
-                "IMPORTANT: Ensure that absolutely no part of the original function's implementation is omitted or modified in your response. Every line, including imports, comments, and variable bindings, should be retained in the output. This is crucial to satisfy my use case. "
-                "The docstring may, however, be revised. "
-                "IMPORTANT: It is vital that everything is wrapped inside a single markdown code block only.")
-        else:
-            comment_instructions = (
-                "Return the doc comment as a single markdown block. "
-                "If the doc comment consists of more than one sentence then please follow multi-line comments."
-                f"IMPORTANT: Please avoid writing any code in the markdown block. Ensure that the markdown block contains only doc comments and enclose them appropriately using the correct comment delimiters for the {language} language."
-                """
-                Example Comment for Haskell language:
-                -- | This is the first line of a demo comment.
-                -- This is the second line of a demo comment."
-                i.e. Correct comment delimiters for Haskell language is '-- ' where the first line of the comment will be prefixed with '-- | '.
-                """
-                "Strictly avoid writing detailed comments for self-explanatory functions."
-                "IMPORTANT: Strictly refrain from detailing input parameters or specifying what the function takes as input and its definition. This is crucial to meet my use case."
-                "IMPORTANT: Please follow only the specified format. This is very important to satisfy my use case."
+            for index, doc_comment in zip(batch, results):
+                doc_comments[index] = doc_comment
+
+        await asyncio.gather(*[generate_batch(batch) for batch in batches])
+
+        for structure_key, index in representatives.items():
+            self.structure_doc_comments[structure_key] = (normalized[index][1], doc_comments[index])
+
+        remaining_duplicates = []
+        for index, representative in duplicates.items():
+            doc_comments[index] = utils.rename_identifiers(
+                doc_comments[representative], normalized[representative][1], normalized[index][1]
             )
+            if doc_comments[index] is None:
+                remaining_duplicates.append(index)
+
+        # Duplicates whose identifiers could not be renamed safely get their own request
+        results = await asyncio.gather(
+            *[self.agenerate_doc_comment(language, codes[index]) for index in remaining_duplicates]
+        )
+        for index, doc_comment in zip(remaining_duplicates, results):
+            doc_comments[index] = doc_comment
 
+        return doc_comments
+
+    async def _agenerate_batch(self, language, codes):
+        code = "\n\n".join(
+            f"### FUNCTION {number} ###\n{method_code}"
+            for number, method_code in enumerate(codes, start=1)
+        )
+        messages = self._to_messages(
+            BATCH_COMMENT_INSTRUCTIONS,
+            language,
+            HASKELL_INSTRUCTIONS if language == "haskell" else "",
+            code,
+            user_prompt=BATCH_USER_PROMPT,
+        )
+        response = await self.llm.ainvoke(messages, self.max_output_tokens * len(codes))
+        return utils.parse_batch_response(response, len(codes))
+
+    def _output_token_limit(self, code, inline, comment_with_source_code):
+        # The response repeats the method when the source code is requested,
+        # otherwise it only consists of the comment
+        if inline or comment_with_source_code:
+            return self.max_output_tokens + utils.count_tokens(code)
+        return self.max_output_tokens
+
+    def _cache_key(self, messages, max_tokens, mode):
+        # The rendered prompt is part of the key, so that a change of the
+        # prompts never serves responses to the previous ones. A response can
+        # also be truncated by the output limit, so the limit is part of it too.
+        if self.cache is None:
+            return None
+        parts = [self.model_name, mode, str(max_tokens)]
+        parts += [f"{message['role']}: {message['content']}" for message in messages]
+        if mode == "comment":
+            # Comments are also taken from the responses to batched requests
+            parts += [BATCH_COMMENT_INSTRUCTIONS, BATCH_USER_PROMPT]
+        return ResponseCache.key(*parts)
+
+    @staticmethod
+    def _comment_mode(inline, comment_with_source_code):
+        if inline:
+            return "inline"
+        elif comment_with_source_code:
+            return "comment_with_source_code"
+        return "comment"
+
+    def _build_prompt(self, language, code, inline, comment_with_source_code, docstring):
+        comment_instructions = COMMENT_INSTRUCTIONS[
+            self._comment_mode(inline, comment_with_source_code)
+        ]
+
+        method_instructions = ""
         if language == "haskell":
-            haskell_missing_signature = "and missing type signatures "
-        else:
-            haskell_missing_signature = ""
-
-        input = {
-            "language": language,
-            "code": code,
-            "comment_instructions": comment_instructions,
-            "haskell_missing_signature": haskell_missing_signature,
-        }
-
-        #print(input)
-        #documented_code = self.chain.run(input)
-        prompt = self.template.invoke(input)
-        #print(prompt)
-        documented_code = self.llm.invoke(prompt)
-        #print(documented_code)
-        return documented_code
+            method_instructions += HASKELL_INSTRUCTIONS
+        if comment_with_source_code and not inline and docstring and len(docstring.strip())>0:
+            method_instructions += DOCSTRING_INSTRUCTIONS + docstring + '. '
+
+        return self._to_messages(comment_instructions, language, method_instructions, code)
+
+    @staticmethod
+    def _to_messages(comment_instructions, language, method_instructions, code, user_prompt=USER_PROMPT):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": comment_instructions},
+            {
+                "role": "user",
+                "content": user_prompt.format(
+                    language=language, method_instructions=method_instructions, code=code
+                ),
+            },
+        ]
+
+    def check_model_quantization(self, model_path):
+        """
+        Warns if the local GGUF model holds unquantized weights.
+
+        Decoding is bound by memory bandwidth, so a 4-bit K-quant model
+        (e.g. Q4_K_M) generates tokens considerably faster than F16/F32 weights.
+        """
+        file_type = utils.get_gguf_file_type(model_path)
+        if file_type in utils.GGUF_UNQUANTIZED_FILE_TYPES:
+            print(
+                f"Warning: The model {utils.get_bold_text(model_path)} is not quantized "
+                f"({utils.GGUF_UNQUANTIZED_FILE_TYPES[file_type]} weights). "
+                f"Consider using a {utils.get_bold_text('Q4_K_M')} or "
+                f"{utils.get_bold_text('Q5_K_M')} variant of the model for faster generation."
+            )
+
+    def check_ollama_quantization(self):
+        """
+        Suggests a 4/5-bit quantized variant if the Ollama model is served
+        with a higher precision, e.g. F16 or Q8_0.
+        """
+        quantization_level = self.llm.quantization_level()
+        if quantization_level and quantization_level.upper() not in RECOMMENDED_OLLAMA_QUANTIZATIONS:
+            print(
+                f"Warning: The Ollama model {utils.get_bold_text(self.llm.model)} is served with "
+                f"{quantization_level} weights. Consider using a {utils.get_bold_text('q4_K_M')} "
+                f"tag of the model (e.g. with {utils.get_bold_text('--quant q4_K_M')}) for faster generation."
+            )
 
     def install_llama_cpp(self):
         try:
@@ -151,64 +478,10 @@ class LLM:
 
             answers = inquirer.prompt(question)
             if answers and answers["confirm"]:
-                import platform
-
-                def check_command(command):
-                    try:
-                        subprocess.run(
-                            command,
-                            check=True,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                        )
-                        return True
-                    except subprocess.CalledProcessError:
-                        return False
-                    except FileNotFoundError:
-                        return False
-
-                def install_llama(backend):
-                    env_vars = {"FORCE_CMAKE": "1"}
-
-                    if backend == "cuBLAS":
-                        env_vars["CMAKE_ARGS"] = "-DLLAMA_CUBLAS=on"
-                    elif backend == "hipBLAS":
-                        env_vars["CMAKE_ARGS"] = "-DLLAMA_HIPBLAS=on"
-                    elif backend == "Metal":
-                        env_vars["CMAKE_ARGS"] = "-DLLAMA_METAL=on"
-                    else:  # Default to OpenBLAS
-                        env_vars[
-                            "CMAKE_ARGS"
-                        ] = "-DLLAMA_BLAS=ON -DLLAMA_BLAS_VENDOR=OpenBLAS"
-
-                    try:
-                        subprocess.run(
-                            [
-                                sys.executable,
-                                "-m",
-                                "pip",
-                                "install",
-                                "llama-cpp-python",
-                            ],
-                            env={**os.environ, **env_vars},
-                            check=True,
-                        )
-                    except subprocess.CalledProcessError as e:
-                        print(f"Error during installation with {backend}: {e}")
-
-                def supports_metal():
-                    # Check for macOS version
-                    if platform.system() == "Darwin":
-                        mac_version = tuple(map(int, platform.mac_ver()[0].split(".")))
-                        # Metal requires macOS 10.11 or later
-                        if mac_version >= (10, 11):
-                            return True
-                    return False
-
                 # Check system capabilities
-                if check_command(["nvidia-smi"]):
+                if has_command("nvidia-smi"):
                     install_llama("cuBLAS")
-                elif check_command(["rocminfo"]):
+                elif has_command("rocminfo"):
                     install_llama("hipBLAS")
                 elif supports_metal():
                     install_llama("Metal")
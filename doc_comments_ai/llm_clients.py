@@ -0,0 +1,180 @@
+import asyncio
+import importlib.util
+import inspect
+import threading
+
+import httpx
+import ollama
+from langchain_community.llms import LlamaCpp
+
+
+class LiteLLMClient:
+    """
+    Calls the litellm completion API directly for OpenAI and Azure OpenAI models.
+    """
+
+    def __init__(self, model: str, temperature: float):
+        # litellm takes seconds to import, so only pay for it when it is used
+        import litellm
+
+        self.litellm = litellm
+        self.model = model
+        self.temperature = temperature
+
+    def invoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        response = self.litellm.completion(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+    async def ainvoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        response = await self.litellm.acompletion(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+    async def astream(self, messages: "list[dict]", max_tokens: int):
+        response = await self.litellm.acompletion(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        try:
+            async for chunk in response:
+                yield chunk.choices[0].delta.content or ""
+        finally:
+            # Closes the connection if the caller stops early,
+            # which makes the provider stop generating
+            await self._aclose(response)
+
+    @staticmethod
+    async def _aclose(response):
+        # Newer litellm versions close the stream wrapper, older ones
+        # only expose the stream of the provider which is wrapped
+        close = getattr(response, "aclose", None)
+        if close is None:
+            stream = getattr(response, "completion_stream", None)
+            close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+
+class OllamaClient:
+    """
+    Calls the chat endpoint of an Ollama server with the ollama client library.
+    """
+
+    # Upper bound for the concurrent requests of a run, all of which share
+    # one pool of kept-alive connections instead of reconnecting per request
+    MAX_CONNECTIONS = 32
+    TIMEOUT = 600
+    # The quantization check is only advisory and must not stall the startup
+    # on a slow or unreachable host
+    PROBE_TIMEOUT = 5
+
+    def __init__(self, base_url: str, model: str, temperature: float, num_ctx: int):
+        self.base_url = base_url
+        self.model = model
+        self.options = {"temperature": temperature, "num_ctx": num_ctx}
+        self.client = ollama.Client(host=base_url, **self._http_options())
+        self.async_client = None
+        self.async_client_loop = None
+
+    def quantization_level(self) -> "str | None":
+        """
+        Returns the quantization level of the served model, e.g. Q4_K_M, as
+        reported by the /api/show endpoint, or None if it is not available.
+        """
+        try:
+            probe_client = ollama.Client(host=self.base_url, timeout=self.PROBE_TIMEOUT)
+            details = probe_client.show(self.model)["details"]
+        except Exception:  # The check is only advisory, never fail on it
+            return None
+        return details["quantization_level"] if details else None
+
+    def _http_options(self) -> dict:
+        return {
+            "timeout": self.TIMEOUT,
+            "limits": httpx.Limits(
+                max_connections=self.MAX_CONNECTIONS,
+                max_keepalive_connections=self.MAX_CONNECTIONS,
+            ),
+            # HTTP/2 multiplexes requests over a single connection, it is
+            # negotiated for https hosts if the optional h2 package is installed
+            "http2": importlib.util.find_spec("h2") is not None,
+        }
+
+    def _get_async_client(self) -> ollama.AsyncClient:
+        # The connections of an async client are bound to the event loop,
+        # so one client is kept for each event loop instead of one per request
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client_loop is not loop:
+            self.async_client = ollama.AsyncClient(host=self.base_url, **self._http_options())
+            self.async_client_loop = loop
+        return self.async_client
+
+    def invoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        response = self.client.chat(
+            model=self.model,
+            messages=messages,
+            options={**self.options, "num_predict": max_tokens},
+        )
+        return response["message"]["content"]
+
+    async def ainvoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        response = await self._get_async_client().chat(
+            model=self.model,
+            messages=messages,
+            options={**self.options, "num_predict": max_tokens},
+        )
+        return response["message"]["content"]
+
+    async def astream(self, messages: "list[dict]", max_tokens: int):
+        stream = await self._get_async_client().chat(
+            model=self.model,
+            messages=messages,
+            options={**self.options, "num_predict": max_tokens},
+            stream=True,
+        )
+        try:
+            async for part in stream:
+                yield part["message"]["content"]
+        finally:
+            # Closes the connection if the caller stops early,
+            # which makes the server stop generating
+            await stream.aclose()
+
+
+class LlamaCppClient:
+    """
+    Runs a local GGUF model with the LangChain LlamaCpp wrapper.
+    """
+
+    def __init__(self, **kwargs):
+        self.llm = LlamaCpp(**kwargs)
+        # The model runs in process and is not thread safe
+        self.lock = threading.Lock()
+
+    def invoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        with self.lock:
+            return self.llm.invoke(
+                [(message["role"], message["content"]) for message in messages],
+                max_tokens=max_tokens,
+            )
+
+    async def ainvoke(self, messages: "list[dict]", max_tokens: int) -> str:
+        return await asyncio.to_thread(self.invoke, messages, max_tokens)
+
+    async def astream(self, messages: "list[dict]", max_tokens: int):
+        # The in-process model is not streamed, the response arrives at once
+        yield await self.ainvoke(messages, max_tokens)
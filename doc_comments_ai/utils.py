@@ -1,5 +1,8 @@
+import json
+import keyword
 import os
 import re
+import struct
 import subprocess
 import sys
 
@@ -33,6 +36,7 @@ def get_programming_language(file_extension: str) -> Language:
         ".go": Language.GO,
         ".cpp": Language.CPP,
         ".c": Language.C,
+        ".h": Language.C,
         ".cs": Language.C_SHARP,
         ".hs": Language.HASKELL,
     }
@@ -144,6 +148,174 @@ def extract_content_from_markdown_code_block(markdown_code_block) -> str:
     else:
         return markdown_code_block.strip()
 
+class ClosingCodeFenceFinder:
+    """
+    Finds the end of the first complete markdown code block in a streamed response,
+    i.e. the closing fence at the start of a line which follows an opening fence.
+
+    The state of the scan is kept between the chunks, so every chunk is only
+    scanned once instead of the whole response received so far.
+    """
+
+    def __init__(self):
+        self.opened = False
+        # Offset of the pending line, which is not terminated yet
+        self.position = 0
+        self.pending = ""
+
+    def feed(self, chunk) -> int:
+        """
+        :param chunk: The next part of the response.
+        :return: The index in the whole response right after the closing fence,
+                 or -1 if the code block is not closed yet.
+        """
+        lines = (self.pending + chunk).splitlines(keepends=True)
+        # A line is only checked once it is complete
+        self.pending = lines.pop() if lines and lines[-1].splitlines() == [lines[-1]] else ""
+        for line in lines:
+            end = self._scan_line(line)
+            if end != -1:
+                return end
+        return -1
+
+    def close(self) -> int:
+        """
+        Checks the last line of the response, which has no line break.
+        """
+        line, self.pending = self.pending, ""
+        return self._scan_line(line) if line else -1
+
+    def _scan_line(self, line):
+        if line.startswith("```"):
+            if self.opened:
+                return self.position + len(line.rstrip("\r\n"))
+            self.opened = True
+        self.position += len(line)
+        return -1
+
+
+def parse_batch_response(response, count):
+    """
+    Parses the response to a request documenting several methods at once.
+
+    :param response: The response, a JSON array of doc comments, optionally wrapped in a markdown code block.
+    :param count: The number of methods which were sent in the request.
+    :return: The list of doc comments in the order of the methods, or None if the response
+             is not a JSON array of exactly count strings.
+    """
+    content = extract_content_from_markdown_code_block(response)
+    try:
+        doc_comments = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+
+    if (
+        not isinstance(doc_comments, list)
+        or len(doc_comments) != count
+        or not all(isinstance(doc_comment, str) for doc_comment in doc_comments)
+    ):
+        return None
+    return doc_comments
+
+
+# Keywords and builtin type names, which are part of the structure of a method
+# and therefore never abstracted as identifiers
+CODE_KEYWORDS = set(keyword.kwlist) | {
+    "auto", "bool", "boolean", "break", "byte", "case", "catch", "char", "class", "const",
+    "continue", "default", "delete", "do", "double", "else", "enum", "extern", "false",
+    "final", "float", "for", "fn", "func", "function", "goto", "if", "impl", "int", "interface",
+    "let", "long", "match", "mut", "new", "null", "nullptr", "package", "private", "protected",
+    "public", "pub", "register", "return", "self", "short", "signed", "sizeof", "static",
+    "string", "struct", "super", "switch", "this", "throw", "throws", "true", "try", "typedef",
+    "union", "unsigned", "val", "var", "void", "volatile", "where", "while",
+}
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def normalize_identifiers(code):
+    """
+    Abstracts the identifiers of a method, so that methods which only differ in
+    their identifiers have the same normalized form.
+
+    :param code: The source code of the method.
+    :return: A tuple of the normalized code, where the n-th distinct identifier is replaced
+             by ID<n> and whitespace is collapsed, and the list of the distinct identifiers
+             in the order of their first occurrence.
+    """
+    identifiers = {}
+
+    def replace(match):
+        word = match.group(0)
+        if word in CODE_KEYWORDS:
+            return word
+        if word not in identifiers:
+            identifiers[word] = len(identifiers)
+        return f"ID{identifiers[word]}"
+
+    normalized_code = " ".join(IDENTIFIER_PATTERN.sub(replace, code).split())
+    return normalized_code, list(identifiers)
+
+
+def split_identifier(identifier):
+    """
+    Splits an identifier into its lowercase words, e.g. "getUser_id" into ["get", "user", "id"].
+    """
+    return [
+        word.lower()
+        for word in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+", identifier)
+    ]
+
+
+def rename_identifiers(text, identifiers, new_identifiers):
+    """
+    Replaces the identifiers of one method with the ones of another method which has
+    the same normalized form.
+
+    Only whole identifiers can be renamed. Prose which is built from the words of an
+    identifier (e.g. "enabled" for is_enabled) would describe the wrong method, so the
+    text is not renamed if it contains a word of a changed identifier which is not part
+    of the new identifier. Short identifiers (e.g. "i" or "a") can't be told apart from
+    words of the prose either, so every changed identifier the text mentions must have
+    at least three characters.
+
+    :param text: The text, e.g. a doc comment, mentioning the identifiers.
+    :param identifiers: The distinct identifiers of the method the text was written for.
+    :param new_identifiers: The distinct identifiers of the other method, in the same order.
+    :return: The renamed text, or None if an identifier can't be renamed safely.
+    """
+    changes = {
+        identifier: new_identifier
+        for identifier, new_identifier in zip(identifiers, new_identifiers)
+        if identifier != new_identifier
+    }
+    if not changes:
+        return text
+
+    changes_pattern = r"\b(?:" + "|".join(map(re.escape, changes)) + r")\b"
+    prose = re.sub(changes_pattern, " ", text)
+    for identifier, new_identifier in changes.items():
+        changed_words = set(split_identifier(identifier)) - set(split_identifier(new_identifier))
+        for word in changed_words:
+            # Also matches inflections, e.g. "widths" for width
+            if re.search(r"\b" + re.escape(word), prose, flags=re.IGNORECASE):
+                return None
+
+    renames = {
+        identifier: new_identifier
+        for identifier, new_identifier in changes.items()
+        if re.search(r"\b" + re.escape(identifier) + r"\b", text)
+    }
+    if not renames:
+        return text
+
+    if any(len(identifier) < 3 for identifier in renames):
+        return None
+
+    pattern = r"\b(?:" + "|".join(map(re.escape, renames)) + r")\b"
+    return re.sub(pattern, lambda match: renames[match.group(0)], text)
+
+
 # This function retrieves the comment pattern for a specified programming language
 def get_comments_pattern_for_language(language):
     comment_patterns = {
@@ -276,3 +448,95 @@ def is_azure_openai_environment_available():
         if not azure_api_version:
             print("AZURE_API_VERSION not found.")
         sys.exit("Please set the environment variables for Azure OpenAI deployment.")
+
+
+def apply_quantization_tag(model, quantization):
+    """
+    Adds the quantization to the tag of an Ollama model name, replacing a quantization
+    which is already part of the tag.
+
+    Args:
+        model (str): The Ollama model name, e.g. "llama3:8b-instruct".
+        quantization (str): The quantization, e.g. "q4_K_M".
+
+    Returns:
+        str: The model name with the quantization, e.g. "llama3:8b-instruct-q4_K_M". Model names
+        without a tag or with the "latest" tag are returned unchanged, since the tag naming
+        differs between models.
+    """
+    name, _, tag = model.partition(":")
+    if not tag or tag == "latest":
+        print(
+            f"Warning: {get_bold_text('--quant')} is ignored, the model {get_bold_text(model)} has no "
+            f"explicit tag to add it to. Specify the full tag instead, e.g. llama3:8b-instruct-{quantization}."
+        )
+        return model
+    # The quantization is either the last part of the tag or the whole tag
+    tag = re.sub(r"(^|-)(q\d\w*|fp16|f16|f32|bf16)$", "", tag, flags=re.IGNORECASE)
+    return f"{name}:{tag}-{quantization}" if tag else f"{name}:{quantization}"
+
+
+# Byte sizes of the fixed size GGUF metadata value types
+_GGUF_SCALAR_SIZES = {0: 1, 1: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4, 7: 1, 10: 8, 11: 8, 12: 8}
+_GGUF_TYPE_STRING = 8
+_GGUF_TYPE_ARRAY = 9
+
+# Values of `general.file_type` for unquantized weights
+GGUF_UNQUANTIZED_FILE_TYPES = {0: "F32", 1: "F16", 32: "BF16"}
+
+
+def get_gguf_file_type(model_path):
+    """
+    Reads the `general.file_type` entry from the metadata header of a GGUF model file.
+
+    Only the header is read, the tensor data is never touched.
+
+    Args:
+        model_path (str): The path of the .gguf model file.
+
+    Returns:
+        int | None: The llama.cpp file type (e.g. 1 for F16, 15 for Q4_K_M), or None if
+        the file is not a GGUF v2/v3 file or does not declare a file type.
+    """
+
+    def read(file, fmt):
+        size = struct.calcsize(fmt)
+        data = file.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of GGUF header")
+        return struct.unpack(fmt, data)[0]
+
+    def read_string(file):
+        return file.read(read(file, "<Q"))
+
+    def skip_value(file, value_type):
+        if value_type in _GGUF_SCALAR_SIZES:
+            file.seek(_GGUF_SCALAR_SIZES[value_type], os.SEEK_CUR)
+        elif value_type == _GGUF_TYPE_STRING:
+            file.seek(read(file, "<Q"), os.SEEK_CUR)
+        elif value_type == _GGUF_TYPE_ARRAY:
+            item_type = read(file, "<I")
+            count = read(file, "<Q")
+            if item_type in _GGUF_SCALAR_SIZES:
+                file.seek(_GGUF_SCALAR_SIZES[item_type] * count, os.SEEK_CUR)
+            else:
+                for _ in range(count):
+                    skip_value(file, item_type)
+        else:
+            raise ValueError(f"Unknown GGUF value type {value_type}")
+
+    try:
+        with open(model_path, "rb") as file:
+            if file.read(4) != b"GGUF" or read(file, "<I") not in (2, 3):
+                return None
+            read(file, "<Q")  # tensor count
+            kv_count = read(file, "<Q")
+            for _ in range(kv_count):
+                key = read_string(file)
+                value_type = read(file, "<I")
+                if key == b"general.file_type" and value_type in (4, 5):
+                    return read(file, "<I" if value_type == 4 else "<i")
+                skip_value(file, value_type)
+    except (OSError, ValueError, struct.error):
+        return None
+    return None
@@ -1,18 +1,111 @@
-from doc_comments_ai import app
+from doc_comments_ai import app, llm, utils
+from doc_comments_ai.cache import ResponseCache
 import argparse
-import sys
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-def main():
-    app.run()
+# Extensions of the source files which are documented
+SOURCE_FILE_EXTENSIONS = ('.c', '.h', '.cpp', '.py')
 
-def iterate_files(folder_path):
-    file_paths = []
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_paths.append(file_path)
-    return file_paths
+# Maximum number of parsed files waiting for the LLM, keeps the memory flat
+QUEUE_SIZE = 64
+
+def parse_file(filepath, args):
+    """
+    Parses a file into the methods to document; runs in a worker thread.
+    """
+    print(filepath)
+    if utils.has_unstaged_changes(filepath):
+        print(f"File {utils.get_bold_text(filepath)} has unstaged changes. Skipping...")
+        return None
+    return app.collect_methods(
+        filepath,
+        line_threshold=args.line_threshold,
+        regenerate_docstring=args.regenerate_docstring,
+        token_limit=None,
+    )
+
+def parse_next_file(files, args):
+    """
+    Takes the files from the lazy walk until one with methods to document is
+    found and returns it with its parsed methods, or None once the walk is
+    done. Runs in a worker thread, so the walk never blocks the event loop.
+    """
+    for filepath in files:
+        parsed = parse_file(filepath, args)
+        if parsed is not None and parsed[1]:
+            return filepath, parsed
+    return None
+
+async def document_files(files, llm_wrapper, args):
+    """
+    Documents the files in a producer/consumer pipeline: a worker thread
+    parses the files while the consumers wait for the LLM responses of the
+    files parsed before, and write them back.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def produce(executor):
+        # A single worker thread, so the file generator is never advanced concurrently
+        while True:
+            parsed_file = await loop.run_in_executor(executor, parse_next_file, files, args)
+            if parsed_file is None:
+                break
+            filepath, parsed = parsed_file
+            await queue.put((filepath, *parsed))
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            filepath, programming_language, methods, total_original_tokens = item
+            doc_comment_results = await app.generate_doc_comments(
+                llm_wrapper,
+                programming_language,
+                methods,
+                comment_with_source_code=args.comment_with_source_code,
+                batch_size=args.batch_size,
+                dedupe=args.dedupe,
+            )
+            # Every file is handled by a single consumer, so no other
+            # write to the same file can interleave
+            total_generated_tokens = app.write_doc_comments(
+                filepath,
+                programming_language,
+                methods,
+                doc_comment_results,
+                comment_with_source_code=args.comment_with_source_code,
+            )
+            print(f"📊 Total Input Tokens of {utils.get_bold_text(filepath)}: {total_original_tokens}")
+            print(f"🚀 Total Generated Tokens of {utils.get_bold_text(filepath)}: {total_generated_tokens}")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        await asyncio.gather(produce(executor), *[consume() for _ in range(args.concurrency)])
+
+def iterate_files(folder_path, extensions=SOURCE_FILE_EXTENSIONS):
+    """
+    Lazily yields the paths of all files below folder_path with one of the
+    given extensions. os.scandir provides the entry type without an extra
+    stat call, so the tree is walked in a single pass.
+    """
+    stack = [folder_path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # Like os.walk, skip directories which can't be read or vanished
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    yield entry.path
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Documentation generation master script')
@@ -20,6 +113,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--ollama-model",
         type=str,
+        required=True,
         help="Ollama model for base url",
     )
     parser.add_argument(
@@ -42,6 +136,45 @@ if __name__ == "__main__":
         help="Generate comments for functions with length longer than the specified threshold (default: 3)."
     )
 
+    parser.add_argument(
+        "--quant",
+        type=str,
+        help="Quantization appended to the tag of the Ollama model, e.g. q4_K_M turns llama3:8b-instruct into llama3:8b-instruct-q4_K_M."
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        default=8,
+        type=int,
+        help="Maximum number of methods documented with a single request if only comments are generated (default: 8, 1 disables batching)."
+    )
+
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Request a single doc comment for methods which only differ in their identifiers and rename the identifiers for the others. Only applies if only comments are generated."
+    )
+
+    parser.add_argument(
+        "--max_output_tokens",
+        default=512,
+        type=int,
+        help="Maximum number of tokens generated for a doc comment, on top of the method itself if the source code is returned (default: 512)."
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        default=4,
+        type=int,
+        help="Number of files documented at the same time (default: 4)."
+    )
+
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Always query the LLM instead of reusing responses cached in ~/.cache/doc-comments-ai."
+    )
+
     parser.add_argument(
         "--regenerate_docstring",
         default=False,
@@ -51,35 +184,27 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
 
+    if args.concurrency < 1:
+        # Without a consumer the producer blocks forever on the full queue
+        parser.error("--concurrency must be at least 1")
+
     folder = args.path
     if not os.path.exists(folder):
         print("Please verify the folder path")
         exit(0)
-    # Example usage
+    # The files are discovered lazily while the previous ones are documented
     files = iterate_files(folder)
 
-    #Remove the kwargs for path from the sys.argv
-    index = 0
-    del_index = -1
-    for args in sys.argv:
-        if args == '-p' or args == '--path':
-            del_index = index
-            break
-        index += 1
-    
-    if del_index > 0:
-        del sys.argv[del_index+1]
-        del sys.argv[del_index]
-    
-    first = True
-    for filepath in files:
-        if filepath.endswith('.c') or filepath.endswith('.py'):
-        #if filepath[-2:]=='.c':
-            print(filepath)
-            if first:
-                sys.argv.append(filepath)
-                first = False
-            else:
-                sys.argv[-1] = filepath
-            main()
+    # Build the LLM once so that the model is not reloaded for every file
+    cache = None if args.no_cache else ResponseCache()
+    ollama_model = args.ollama_model
+    if args.quant:
+        ollama_model = utils.apply_quantization_tag(ollama_model, args.quant)
+    llm_wrapper = llm.LLM(
+        ollama=(args.ollama_base_url, ollama_model),
+        cache=cache,
+        max_output_tokens=args.max_output_tokens,
+    )
 
+    # All files share one event loop, so that the LLM's client can be reused
+    asyncio.run(document_files(files, llm_wrapper, args))
@@ -12,5 +12,5 @@ from tests.fixtures.code_fixture_rs import rust_code_fixture
 from tests.fixtures.code_fixture_ts import typescript_code_fixture
 from tests.fixtures.code_fixture_hs import haskell_code_fixture
 from tests.fixtures.response_fixtures import (
-    response_fixture, response_fixture_language_enclosed,
-    response_fixture_with_text)
+    batch_response_fixture, response_fixture,
+    response_fixture_language_enclosed, response_fixture_with_text)
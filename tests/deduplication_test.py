@@ -0,0 +1,66 @@
+from doc_comments_ai import utils
+
+
+def test_normalize_identifiers():
+    user_code = "int get_user_id(struct user *u) {\n    return u->user_id;\n}"
+    item_code = "int get_item_id(struct item *i)\n{\n  return i->item_id;\n}"
+
+    normalized_user_code, user_identifiers = utils.normalize_identifiers(user_code)
+    normalized_item_code, item_identifiers = utils.normalize_identifiers(item_code)
+
+    assert normalized_user_code == "int ID0(struct ID1 *ID2) { return ID2->ID3; }"
+    assert normalized_user_code == normalized_item_code
+    assert user_identifiers == ["get_user_id", "user", "u", "user_id"]
+    assert item_identifiers == ["get_item_id", "item", "i", "item_id"]
+
+    # The same identifier used for two roles is a different structure
+    assert (
+        utils.normalize_identifiers("int f(int a, int b) { return a; }")[0]
+        != utils.normalize_identifiers("int f(int a, int b) { return b; }")[0]
+    )
+
+
+def test_rename_identifiers():
+    user_identifiers = ["get_user_id", "user", "u", "user_id"]
+    item_identifiers = ["get_item_id", "item", "i", "item_id"]
+
+    assert (
+        utils.rename_identifiers(
+            "/* Returns the user_id of the given user. */", user_identifiers, item_identifiers
+        )
+        == "/* Returns the item_id of the given item. */"
+    )
+
+    # "u" and "i" can't be told apart from prose
+    assert (
+        utils.rename_identifiers("/* Returns the id of u. */", user_identifiers, item_identifiers)
+        is None
+    )
+
+
+def test_rename_identifiers_refuses_words_of_identifiers():
+    enabled_code = "int is_enabled(struct dev *d) { return d->flags & 1; }"
+    busy_code = "int is_busy(struct dev *d) { return d->state & 1; }"
+    normalized_enabled_code, enabled_identifiers = utils.normalize_identifiers(enabled_code)
+    normalized_busy_code, busy_identifiers = utils.normalize_identifiers(busy_code)
+    assert normalized_enabled_code == normalized_busy_code
+
+    # "enabled" describes is_enabled, but isn't an identifier which could be renamed
+    assert (
+        utils.rename_identifiers(
+            "/* Checks whether the device is enabled. */", enabled_identifiers, busy_identifiers
+        )
+        is None
+    )
+    # Whole identifiers are renamed, words shared by both identifiers ("is") don't matter
+    assert (
+        utils.rename_identifiers(
+            "/* Returns whether the lowest bit of flags is set. */", enabled_identifiers, busy_identifiers
+        )
+        == "/* Returns whether the lowest bit of state is set. */"
+    )
+
+
+def test_split_identifier():
+    assert utils.split_identifier("get_user_id") == ["get", "user", "id"]
+    assert utils.split_identifier("getHTTPResponse") == ["get", "http", "response"]
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+from doc_comments_ai import utils
+from docgen import document_files, iterate_files
+
+CODE = "def {name}(a, b):\n    c = a + b\n    d = c * 2\n    return d\n"
+
+
+class StubLLM:
+    """
+    Stands in for the LLM wrapper, documenting every method with a fixed comment.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def agenerate_doc_comments(self, language, codes, batch_size=8, dedupe=False):
+        self.calls += 1
+        # Lets the other consumers run in between
+        await asyncio.sleep(0)
+        return ["# Generated." for _ in codes]
+
+
+def test_document_files(tmp_path, monkeypatch, capsys):
+    # The files are not part of a git repository, and tiktoken downloads its encoding on first use
+    monkeypatch.setattr(utils, "has_unstaged_changes", lambda file: False)
+    monkeypatch.setattr(utils, "count_tokens", lambda text: len(text.split()))
+
+    (tmp_path / "pkg").mkdir()
+    paths = [tmp_path / f"module{number}.py" for number in range(6)]
+    paths += [tmp_path / "pkg" / f"module{number}.py" for number in range(4)]
+    for number, path in enumerate(paths):
+        path.write_text(CODE.format(name=f"function{number}"))
+
+    walk_threads = set()
+
+    def files():
+        for filepath in iterate_files(str(tmp_path)):
+            walk_threads.add(threading.current_thread())
+            yield filepath
+
+    args = argparse.Namespace(
+        line_threshold=1,
+        regenerate_docstring=False,
+        comment_with_source_code=False,
+        batch_size=8,
+        dedupe=False,
+        concurrency=3,
+    )
+    llm_wrapper = StubLLM()
+    # Fails instead of hanging if a consumer never receives its sentinel
+    asyncio.run(asyncio.wait_for(document_files(files(), llm_wrapper, args), timeout=10))
+
+    assert llm_wrapper.calls == len(paths)
+    for path in paths:
+        assert path.read_text().count("------ AI Generated Comment ------") == 1
+    # The walk is advanced by the worker thread, not on the event loop
+    assert threading.main_thread() not in walk_threads
+    assert capsys.readouterr().out.count("Total Generated Tokens of") == len(paths)
+
+
+def test_docgen_rejects_concurrency_below_one(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "docgen.py", "--ollama-model", "llama3", "-p", str(tmp_path), "--concurrency", "0"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 2
+    assert "--concurrency must be at least 1" in result.stderr
@@ -60,3 +60,15 @@ return f"\033[01m{text}\033[0m"
 ```
 This a text
 """
+
+
+@pytest.fixture
+def batch_response_fixture():
+    return """
+```json
+[
+    "# Returns the sum of both numbers.",
+    "# Returns the product of both numbers."
+]
+```
+"""
@@ -0,0 +1,56 @@
+import struct
+
+from doc_comments_ai import utils
+
+
+def _gguf_string(value: bytes) -> bytes:
+    return struct.pack("<Q", len(value)) + value
+
+
+def _write_gguf(path, kv_pairs):
+    header = b"GGUF" + struct.pack("<IQQ", 3, 0, len(kv_pairs))
+    with open(path, "wb") as file:
+        file.write(header + b"".join(kv_pairs))
+
+
+def test_gguf_file_type(tmp_path):
+    model_path = tmp_path / "model.gguf"
+    _write_gguf(
+        model_path,
+        [
+            _gguf_string(b"general.architecture")
+            + struct.pack("<I", 8)
+            + _gguf_string(b"llama"),
+            _gguf_string(b"tokenizer.ggml.tokens")
+            + struct.pack("<IIQ", 9, 8, 2)
+            + _gguf_string(b"<s>")
+            + _gguf_string(b"</s>"),
+            _gguf_string(b"tokenizer.ggml.scores")
+            + struct.pack("<IIQ", 9, 6, 2)
+            + struct.pack("<ff", 0.0, 0.0),
+            _gguf_string(b"general.file_type") + struct.pack("<II", 4, 15),
+        ],
+    )
+
+    assert utils.get_gguf_file_type(str(model_path)) == 15
+
+
+def test_gguf_file_type_unquantized(tmp_path):
+    model_path = tmp_path / "model.gguf"
+    _write_gguf(
+        model_path,
+        [_gguf_string(b"general.file_type") + struct.pack("<II", 4, 1)],
+    )
+
+    file_type = utils.get_gguf_file_type(str(model_path))
+    assert utils.GGUF_UNQUANTIZED_FILE_TYPES[file_type] == "F16"
+
+
+def test_gguf_file_type_missing(tmp_path):
+    model_path = tmp_path / "model.gguf"
+    _write_gguf(model_path, [])
+    assert utils.get_gguf_file_type(str(model_path)) is None
+
+    not_a_model = tmp_path / "model.bin"
+    not_a_model.write_bytes(b"not a gguf file")
+    assert utils.get_gguf_file_type(str(not_a_model)) is None
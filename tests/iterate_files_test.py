@@ -0,0 +1,40 @@
+import os
+
+from docgen import iterate_files
+
+
+def test_iterate_files(tmp_path):
+    (tmp_path / "pkg" / "nested").mkdir(parents=True)
+    for relative_path in [
+        "main.c",
+        "main.h",
+        "main.o",
+        "README.md",
+        "pkg/module.py",
+        "pkg/module.pyc",
+        "pkg/nested/util.c",
+        "pkg/nested/util.cpp",
+    ]:
+        (tmp_path / relative_path).write_text("")
+
+    files = sorted(os.path.relpath(path, tmp_path) for path in iterate_files(str(tmp_path)))
+
+    assert files == [
+        "main.c",
+        "main.h",
+        os.path.join("pkg", "module.py"),
+        os.path.join("pkg", "nested", "util.c"),
+        os.path.join("pkg", "nested", "util.cpp"),
+    ]
+
+
+def test_iterate_files_skips_vanished_directories(tmp_path):
+    (tmp_path / "gone").mkdir()
+    (tmp_path / "main.c").write_text("")
+
+    files = iterate_files(str(tmp_path))
+    assert os.path.relpath(next(files), tmp_path) == "main.c"
+
+    # Removed after it was found, but before it is scanned
+    (tmp_path / "gone").rmdir()
+    assert list(files) == []
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from doc_comments_ai import llm, utils
+from doc_comments_ai.cache import ResponseCache
+
+
+class FakeClient:
+    """
+    Stands in for the LiteLLM client, answering every request with respond(messages).
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def invoke(self, messages, max_tokens):
+        self.requests.append(messages)
+        return self.respond(messages)
+
+    async def ainvoke(self, messages, max_tokens):
+        return self.invoke(messages, max_tokens)
+
+    async def astream(self, messages, max_tokens):
+        yield self.invoke(messages, max_tokens)
+
+
+@pytest.fixture
+def make_llm(monkeypatch):
+    # tiktoken downloads its encoding on first use, words are close enough here
+    monkeypatch.setattr(utils, "count_tokens", lambda text: len(text.split()))
+
+    def make(respond, **kwargs):
+        client = FakeClient(respond)
+        monkeypatch.setattr(llm, "LiteLLMClient", lambda **_: client)
+        return llm.LLM(**kwargs), client
+
+    return make
+
+
+def test_cache_key_depends_on_output_limit(make_llm, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    code = "def foo():\n    return 1"
+
+    llm_wrapper, client = make_llm(lambda messages: "# Returns one.", cache=cache)
+    llm_wrapper.generate_doc_comment("python", code)
+    llm_wrapper.generate_doc_comment("python", code)
+    assert len(client.requests) == 1
+
+    # A response limited to fewer tokens may have been truncated
+    llm_wrapper, client = make_llm(lambda messages: "# Returns one.", cache=cache, max_output_tokens=1024)
+    llm_wrapper.generate_doc_comment("python", code)
+    assert len(client.requests) == 1
+
+
+def test_unparsable_batch_response_falls_back_to_single_requests(make_llm):
+    codes = [
+        "def add(a, b):\n    return a + b",
+        "def greet(name):\n    print('Hello', name)\n    return name",
+    ]
+
+    def respond(messages):
+        if "### FUNCTION" in messages[-1]["content"]:
+            return "Here are the doc comments you asked for."
+        return f"# Documents {messages[-1]['content'].split('def ')[1].split('(')[0]}."
+
+    llm_wrapper, client = make_llm(respond)
+    doc_comments = asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes))
+
+    assert doc_comments == ["# Documents add.", "# Documents greet."]
+    assert len(client.requests) == 3
+    assert client.requests[0][-1]["content"].startswith("The methods are written in python language.")
+    assert client.requests[1][-1]["content"].startswith("The method is written in python language.")
+
+
+def respond_by_method_name(doc_comments):
+    def respond(messages):
+        return doc_comments[messages[-1]["content"].split("def ")[1].split("(")[0]]
+
+    return respond
+
+
+def test_dedupe_requests_structurally_identical_methods_once(make_llm):
+    codes = [
+        "def get_width(self):\n    return self.width",
+        "def get_height(self):\n    return self.height",
+        "def add(a, b):\n    return a + b",
+    ]
+    respond = respond_by_method_name({"get_width": "# Returns the width.", "add": "# Adds two numbers."})
+
+    llm_wrapper, client = make_llm(respond)
+    doc_comments = asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes, batch_size=1, dedupe=True))
+
+    assert doc_comments == ["# Returns the width.", "# Returns the height.", "# Adds two numbers."]
+    assert len(client.requests) == 2
+
+    # Without dedupe every method is requested
+    respond = respond_by_method_name(
+        {"get_width": "# Returns the width.", "get_height": "# Returns the height.", "add": "# Adds two numbers."}
+    )
+    llm_wrapper, client = make_llm(respond)
+    asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes, batch_size=1))
+    assert len(client.requests) == 3
+
+
+def test_dedupe_requests_methods_whose_comment_cant_be_renamed(make_llm):
+    codes = [
+        "def is_enabled(dev):\n    return dev.flags & 1",
+        "def is_busy(dev):\n    return dev.state & 1",
+    ]
+    respond = respond_by_method_name(
+        {
+            "is_enabled": "# Checks whether the device is enabled.",
+            "is_busy": "# Checks whether the device is busy.",
+        }
+    )
+
+    llm_wrapper, client = make_llm(respond)
+    doc_comments = asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes, batch_size=1, dedupe=True))
+
+    assert doc_comments == ["# Checks whether the device is enabled.", "# Checks whether the device is busy."]
+    assert len(client.requests) == 2
+
+
+def test_dedupe_does_not_cache_renamed_comments(make_llm, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    codes = [
+        "def get_width(self):\n    return self.width",
+        "def get_height(self):\n    return self.height",
+    ]
+    respond = respond_by_method_name({"get_width": "# Returns the width.", "get_height": "# Returns the height."})
+
+    llm_wrapper, client = make_llm(respond, cache=cache)
+    asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes, batch_size=1, dedupe=True))
+    assert len(client.requests) == 1
+
+    # A run without dedupe requests the method whose comment was renamed
+    llm_wrapper, client = make_llm(respond, cache=cache)
+    doc_comments = asyncio.run(llm_wrapper.agenerate_doc_comments("python", codes, batch_size=1))
+    assert doc_comments == ["# Returns the width.", "# Returns the height."]
+    assert len(client.requests) == 1
+    assert "get_height" in client.requests[0][-1]["content"]
@@ -0,0 +1,33 @@
+from doc_comments_ai import utils
+
+
+def test_apply_quantization_tag():
+    assert (
+        utils.apply_quantization_tag("llama3:8b-instruct", "q4_K_M")
+        == "llama3:8b-instruct-q4_K_M"
+    )
+    assert (
+        utils.apply_quantization_tag("llama3:8b-instruct-fp16", "q4_K_M")
+        == "llama3:8b-instruct-q4_K_M"
+    )
+    assert (
+        utils.apply_quantization_tag("qwen2.5-coder:7b-instruct-q8_0", "q5_K_M")
+        == "qwen2.5-coder:7b-instruct-q5_K_M"
+    )
+    assert (
+        utils.apply_quantization_tag("llama3:8b-instruct-q4_K_M", "q4_K_M")
+        == "llama3:8b-instruct-q4_K_M"
+    )
+
+
+def test_apply_quantization_tag_with_quantization_only_tag():
+    assert (
+        utils.apply_quantization_tag("qwen2.5-coder:q8_0", "q4_K_M")
+        == "qwen2.5-coder:q4_K_M"
+    )
+    assert utils.apply_quantization_tag("llama3:fp16", "q4_K_M") == "llama3:q4_K_M"
+
+
+def test_apply_quantization_tag_without_tag():
+    assert utils.apply_quantization_tag("llama3", "q4_K_M") == "llama3"
+    assert utils.apply_quantization_tag("llama3:latest", "q4_K_M") == "llama3:latest"
@@ -0,0 +1,32 @@
+from doc_comments_ai.cache import ResponseCache
+
+
+def test_response_cache_roundtrip(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    key = ResponseCache.key("gpt-4", "python", "comment", "def foo(): pass", "")
+
+    assert cache.get(key) is None
+
+    cache.set(key, "# Does nothing.")
+    assert cache.get(key) == "# Does nothing."
+
+    # The cache is persisted across instances
+    assert ResponseCache(cache.path).get(key) == "# Does nothing."
+
+
+def test_response_cache_key():
+    key = ResponseCache.key("gpt-4", "python", "comment", "def foo(): pass", "")
+
+    assert key == ResponseCache.key("gpt-4", "python", "comment", "def foo(): pass", "")
+    assert key != ResponseCache.key("gpt-4", "python", "inline", "def foo(): pass", "")
+    assert key != ResponseCache.key("gpt-4", "c", "comment", "def foo(): pass", "")
+    assert ResponseCache.key("ab", "c") != ResponseCache.key("a", "bc")
+
+
+def test_response_cache_skips_empty_responses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    key = ResponseCache.key("gpt-4", "python", "comment", "def foo(): pass", "")
+
+    cache.set(key, "")
+    cache.set(key, "\n  ")
+    assert cache.get(key) is None
@@ -66,3 +66,48 @@ Returns:
 \"\"\"
 return f"\033[01m{text}\033[0m\""""
     )
+
+
+@pytest.mark.usefixtures("batch_response_fixture")
+def test_batch_response_parser(batch_response_fixture):
+    doc_comments = utils.parse_batch_response(batch_response_fixture, 2)
+    assert doc_comments == [
+        "# Returns the sum of both numbers.",
+        "# Returns the product of both numbers.",
+    ]
+
+
+@pytest.mark.usefixtures("batch_response_fixture")
+def test_batch_response_parser_invalid(batch_response_fixture):
+    assert utils.parse_batch_response(batch_response_fixture, 3) is None
+    assert utils.parse_batch_response("# Returns the sum of both numbers.", 1) is None
+    assert utils.parse_batch_response('{"1": "# Returns the sum."}', 1) is None
+
+
+def test_closing_code_fence_finder():
+    response = "Here you go:\n```python\ndef foo():\n    pass\n```\nThe method does nothing."
+    finder = utils.ClosingCodeFenceFinder()
+    end = finder.feed(response)
+    assert response[:end] == "Here you go:\n```python\ndef foo():\n    pass\n```"
+
+    # The fences are split across the chunks
+    finder = utils.ClosingCodeFenceFinder()
+    chunks = [response[start : start + 2] for start in range(0, len(response), 2)]
+    assert [chunk_end for chunk_end in map(finder.feed, chunks) if chunk_end != -1] == [end]
+
+    finder = utils.ClosingCodeFenceFinder()
+    assert finder.feed("```python\ndef foo():\n    pass\n") == -1
+    assert finder.close() == -1
+
+    # Only fences at the start of a line count
+    finder = utils.ClosingCodeFenceFinder()
+    assert finder.feed("```python\ndef foo():\n    s = '''\n    ```\n") == -1
+    assert finder.close() == -1
+
+
+def test_closing_code_fence_finder_close():
+    # The last line of the response has no line break
+    finder = utils.ClosingCodeFenceFinder()
+    assert finder.feed("```python\ndef foo():\n    pass\n``") == -1
+    assert finder.feed("`") == -1
+    assert finder.close() == len("```python\ndef foo():\n    pass\n```")